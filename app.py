@@ -23,6 +23,15 @@ app.config["SQLALCHEMY_ENGINE_OPTIONS"] = {
     "pool_pre_ping": True,
 }
 
+# "direct" commits each quiz attempt in the request; "group_commit" enables
+# SQLite WAL and batches attempt inserts through a background writer
+app.config["QUIZ_WRITE_MODE"] = os.environ.get("QUIZ_WRITE_MODE", "direct")
+app.config["SQLITE_SYNCHRONOUS"] = os.environ.get("SQLITE_SYNCHRONOUS", "FULL")
+app.config["GROUP_COMMIT_INTERVAL_MS"] = float(os.environ.get("GROUP_COMMIT_INTERVAL_MS", "5"))
+
+# Quiz attempts older than this are moved to the archive by `flask archive-attempts`
+app.config["ATTEMPT_RETENTION_DAYS"] = int(os.environ.get("ATTEMPT_RETENTION_DAYS", "90"))
+
 db.init_app(app)
 
 import sys
@@ -31,7 +40,18 @@ import routes                                # keep this line
 
 with app.app_context():
     import models
+    if app.config["QUIZ_WRITE_MODE"] == "group_commit":
+        from attempt_writer import GroupCommitWriter, configure_sqlite
+        configure_sqlite(db.engine, synchronous=app.config["SQLITE_SYNCHRONOUS"])
+        app.extensions["attempt_writer"] = GroupCommitWriter(
+            db.engine,
+            models.QuizAttempt.__table__,
+            flush_interval=app.config["GROUP_COMMIT_INTERVAL_MS"] / 1000.0
+        )
     db.create_all()
+    models.upgrade_schema()
+    routes.search_index.ensure_schema()
+    routes.attempt_retention.ensure_rollups()
 
 if __name__ == "__main__":
     app.run(debug=True)
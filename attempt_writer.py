@@ -0,0 +1,214 @@
+import atexit
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+
+from sqlalchemy import event
+
+SYNCHRONOUS_MODES = ('FULL', 'NORMAL', 'EXTRA')
+
+
+def configure_sqlite(engine, synchronous='FULL', busy_timeout_ms=5000):
+    """
+    Switch a SQLite engine to WAL mode and tune connection pragmas
+
+    WAL lets readers keep going while a writer commits, and with
+    synchronous=FULL every commit is still fsynced, so batching commits is
+    what buys throughput rather than relaxed durability.
+
+    Args:
+        engine: SQLAlchemy engine bound to a SQLite database
+        synchronous (str): Value for PRAGMA synchronous (FULL or NORMAL)
+        busy_timeout_ms (int): How long a connection waits on a locked database
+    """
+    if engine.dialect.name != 'sqlite':
+        logging.info("Skipping SQLite tuning for non-SQLite database")
+        return
+
+    synchronous = str(synchronous).upper()
+    if synchronous not in SYNCHRONOUS_MODES:
+        raise ValueError(f"Unsupported SQLite synchronous mode {synchronous!r}, expected one of {SYNCHRONOUS_MODES}")
+
+    @event.listens_for(engine, 'connect')
+    def _set_sqlite_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute(f"PRAGMA synchronous={synchronous}")
+        cursor.execute(f"PRAGMA busy_timeout={int(busy_timeout_ms)}")
+        cursor.execute("PRAGMA temp_store=MEMORY")
+        cursor.close()
+
+    # Connections opened before the listener was attached keep old settings
+    engine.dispose()
+    logging.info(f"SQLite WAL enabled (synchronous={synchronous})")
+
+
+class GroupCommitWriter:
+    """Funnel single-row inserts into batched transactions
+
+    Request threads call ``submit`` and block until their row is committed.
+    A background thread collects whatever arrives within ``flush_interval``
+    seconds and writes it in one transaction, so a burst of submissions
+    shares one fsync and one acquisition of the SQLite writer lock.
+    """
+
+    _STOP = object()
+
+    def __init__(self, engine, table, flush_interval=0.005, max_batch=256):
+        """
+        Initialize the writer
+
+        Args:
+            engine: SQLAlchemy engine to write through
+            table: Table that rows are inserted into
+            flush_interval (float): Seconds to wait for more rows after the first
+            max_batch (int): Maximum rows committed in one transaction
+        """
+        self.engine = engine
+        self.table = table
+        self.flush_interval = flush_interval
+        self.max_batch = max_batch
+        self._queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def submit(self, values, on_insert=None, timeout=30):
+        """
+        Insert a row and wait until it is committed
+
+        Args:
+            values (dict): Column values for the new row
+            on_insert (callable): Called with (connection, row id) inside the
+                batch transaction, for writes that must commit with the row
+            timeout (float): Seconds to wait for the writer to pick the row up
+
+        Returns:
+            int: Primary key of the inserted row
+        """
+        self._ensure_started()
+        future = Future()
+        self._queue.put((values, on_insert, future))
+        try:
+            return future.result(timeout=timeout)
+        except FutureTimeoutError:
+            # A row still waiting in the queue is withdrawn so it can never be
+            # written after the caller has been told it failed
+            if future.cancel():
+                raise
+            # Already handed to a transaction; wait for its outcome
+            return future.result()
+
+    def stop(self):
+        """Flush pending rows and stop the background thread"""
+        with self._lock:
+            thread, self._thread = self._thread, None
+            if thread is None:
+                return
+            self._queue.put(self._STOP)
+        thread.join()
+
+    def _ensure_started(self):
+        """Start the background thread on first use"""
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='group-commit-writer', daemon=True)
+                self._thread.start()
+                atexit.register(self.stop)
+
+    def _run(self):
+        """Collect rows into batches and commit them"""
+        try:
+            # Hold one connection for the writer's lifetime so flushes never wait
+            # on a pool that request threads have exhausted
+            with self.engine.connect() as connection:
+                self._run_batches(connection)
+        except Exception as e:
+            logging.error(f"Group commit writer stopped unexpectedly: {str(e)}")
+            with self._lock:
+                # The next submit starts a fresh writer
+                if self._thread is threading.current_thread():
+                    self._thread = None
+                self._fail_queued(e)
+
+    def _fail_queued(self, error):
+        """Fail every row still waiting in the queue"""
+        while True:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                return
+            if item is self._STOP:
+                continue
+            future = item[2]
+            if future.set_running_or_notify_cancel():
+                future.set_exception(error)
+
+    def _take(self, item, batch):
+        """Add a queued row to the batch unless its caller already gave up"""
+        if item[2].set_running_or_notify_cancel():
+            batch.append(item)
+
+    def _run_batches(self, connection):
+        """Read batches off the queue until stopped"""
+        while True:
+            item = self._queue.get()
+            if item is self._STOP:
+                return
+
+            batch = []
+            self._take(item, batch)
+            stopping = False
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if item is self._STOP:
+                    stopping = True
+                    break
+                self._take(item, batch)
+
+            try:
+                if batch:
+                    self._flush(connection, batch)
+            except Exception as e:
+                for _, _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                raise
+            if stopping:
+                return
+
+    def _flush(self, connection, batch):
+        """Write one batch in a single transaction and resolve its futures"""
+        start_time = time.time()
+        try:
+            with connection.begin():
+                ids = []
+                for values, on_insert, _ in batch:
+                    row_id = connection.execute(self.table.insert(), values).inserted_primary_key[0]
+                    if on_insert is not None:
+                        on_insert(connection, row_id)
+                    ids.append(row_id)
+        except Exception as e:
+            if len(batch) > 1:
+                # Isolate the bad row so the rest of the batch still commits
+                logging.warning(f"Group commit of {len(batch)} rows failed, retrying individually: {str(e)}")
+                for entry in batch:
+                    self._flush(connection, [entry])
+            else:
+                logging.error(f"Error writing to {self.table.name}: {str(e)}")
+                batch[0][2].set_exception(e)
+            return
+
+        for (_, _, future), row_id in zip(batch, ids):
+            future.set_result(row_id)
+        logging.debug(f"Group commit of {len(batch)} rows took {time.time() - start_time} seconds")
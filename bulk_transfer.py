@@ -0,0 +1,466 @@
+import io
+import json
+import logging
+import os
+import sqlite3
+import tempfile
+import time
+import zipfile
+import zlib
+from contextlib import contextmanager
+from datetime import datetime
+
+from sqlalchemy import create_engine, delete, insert, select
+
+from app import db
+from models import Course, CourseContent, Quiz, QuizAttempt, QuizAttemptArchive
+
+# Record types in dependency order; an import sees parents before children.
+# Archived attempts come before current ones, so they get the older ids.
+RECORD_TYPES = ('course_content', 'course', 'quiz', 'archived_attempt', 'attempt')
+ZIP_MEMBERS = {
+    'course_content': 'course_contents.ndjson',
+    'course': 'courses.ndjson',
+    'quiz': 'quizzes.ndjson',
+    'archived_attempt': 'archived_attempts.ndjson',
+    'attempt': 'attempts.ndjson',
+}
+
+
+class _ZipStream:
+    """Write-only file object that hands zip output back in pieces"""
+
+    def __init__(self):
+        self._buffer = io.BytesIO()
+        self._position = 0
+
+    def write(self, data):
+        self._buffer.write(data)
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        """Return everything written since the last drain"""
+        data = self._buffer.getvalue()
+        self._buffer.seek(0)
+        self._buffer.truncate()
+        return data
+
+
+class BulkTransfer:
+    def __init__(self, batch_size=500, search_index=None, retention=None):
+        """
+        Initialize the BulkTransfer
+
+        Args:
+            batch_size (int): Rows fetched per cursor batch and inserted per statement
+            search_index (SearchIndex): Index updated with imported courses and quizzes
+            retention (AttemptRetention): Rollups updated with imported attempts
+        """
+        self.batch_size = batch_size
+        self.search_index = search_index
+        self.retention = retention
+
+    def export_ndjson(self, course_id=None):
+        """
+        Stream courses, quizzes and current and archived attempts as newline-delimited JSON
+
+        Args:
+            course_id (int): Limit the export to one course, or None for everything
+
+        Yields:
+            bytes: One encoded record per line
+        """
+        with self._snapshot() as connection:
+            for record_type in RECORD_TYPES:
+                for record in self._records(connection, record_type, course_id):
+                    yield self._encode(record)
+
+    def export_zip(self, course_id=None):
+        """
+        Stream a zip archive with one NDJSON file per record type
+
+        Args:
+            course_id (int): Limit the export to one course, or None for everything
+
+        Yields:
+            bytes: Pieces of the zip archive
+        """
+        stream = _ZipStream()
+        with self._snapshot() as connection:
+            with zipfile.ZipFile(stream, 'w', compression=zipfile.ZIP_DEFLATED) as archive:
+                for record_type in RECORD_TYPES:
+                    with archive.open(ZIP_MEMBERS[record_type], 'w', force_zip64=True) as member:
+                        for record in self._records(connection, record_type, course_id):
+                            member.write(self._encode(record))
+                            data = stream.drain()
+                            if data:
+                                yield data
+        yield stream.drain()
+
+    def import_stream(self, fileobj, filename=''):
+        """
+        Import an NDJSON file or zip archive produced by an export
+
+        Records are inserted in batches within one transaction. Course content
+        already present (same content hash) is reused rather than duplicated.
+
+        Args:
+            fileobj: Binary file object with the uploaded data
+            filename (str): Original file name, used to detect zip archives
+
+        Returns:
+            dict: Number of imported records per type
+        """
+        importer = _Importer(self.batch_size, self.retention)
+        try:
+            if filename.endswith('.zip') or zipfile.is_zipfile(fileobj):
+                fileobj.seek(0)
+                with zipfile.ZipFile(fileobj) as archive:
+                    names = set(archive.namelist())
+                    for record_type in RECORD_TYPES:
+                        if ZIP_MEMBERS[record_type] in names:
+                            with archive.open(ZIP_MEMBERS[record_type]) as member:
+                                importer.read_lines(member)
+            else:
+                fileobj.seek(0)
+                importer.read_lines(fileobj)
+            importer.flush()
+            if self.search_index is not None:
+                self._index_imported(importer)
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+
+        logging.info(f"Bulk import completed: {importer.counts}")
+        return importer.counts
+
+    def _index_imported(self, importer):
+        """Add imported courses and quizzes to the search index in batches"""
+        for model, record_type, index in (
+            (Course, 'course', self.search_index.index_course),
+            (Quiz, 'quiz', self.search_index.index_quiz),
+        ):
+            new_ids = list(importer.id_maps[record_type].values())
+            for start in range(0, len(new_ids), self.batch_size):
+                batch_ids = new_ids[start:start + self.batch_size]
+                for row in model.query.filter(model.id.in_(batch_ids)):
+                    index(row)
+
+    @contextmanager
+    def _snapshot(self):
+        """
+        Open a connection whose reads all see the same committed state
+
+        Every record type is read from one snapshot, so an upload committing
+        mid-export cannot leave a course without its content. The export is
+        paced by the client's download, so the snapshot must not lock the
+        live database for that long: a SQLite database in WAL mode is read
+        in one read transaction, which writers don't wait on, and one in
+        rollback-journal mode is first copied with the backup API and the
+        copy is streamed instead.
+        """
+        with db.engine.connect() as connection:
+            if connection.dialect.name != 'sqlite':
+                connection = connection.execution_options(isolation_level='REPEATABLE READ')
+                try:
+                    yield connection
+                finally:
+                    connection.rollback()
+                return
+
+            journal_mode = connection.exec_driver_sql("PRAGMA journal_mode").scalar()
+            if str(journal_mode).lower() == 'wal':
+                # pysqlite only opens transactions before writes; start the
+                # read transaction explicitly so every select shares it
+                connection.exec_driver_sql("BEGIN")
+                try:
+                    yield connection
+                finally:
+                    connection.rollback()
+                return
+
+            with tempfile.TemporaryDirectory() as directory:
+                path = os.path.join(directory, 'export.db')
+                start_time = time.time()
+                copy = sqlite3.connect(path)
+                try:
+                    # Writers wait only while the pages are copied
+                    connection.connection.driver_connection.backup(copy)
+                finally:
+                    copy.close()
+                connection.rollback()
+                logging.debug(f"Export snapshot copied in {time.time() - start_time} seconds")
+
+                copy_engine = create_engine(f"sqlite:///{path}")
+                try:
+                    with copy_engine.connect() as copy_connection:
+                        yield copy_connection
+                finally:
+                    copy_engine.dispose()
+
+    def _records(self, connection, record_type, course_id):
+        """Yield export records of one type using a streaming cursor"""
+        query, to_record = self._export_query(record_type, course_id)
+        result = connection.execution_options(stream_results=True, yield_per=self.batch_size).execute(query)
+        for row in result:
+            yield to_record(row)
+
+    def _export_query(self, record_type, course_id):
+        """Build the select statement and row converter for a record type"""
+        course = Course.__table__
+        content = CourseContent.__table__
+        quiz = Quiz.__table__
+        attempt = QuizAttempt.__table__
+        archive = QuizAttemptArchive.__table__
+
+        if record_type == 'course_content':
+            query = select(content)
+            if course_id is not None:
+                query = query.where(content.c.id.in_(select(course.c.content_id).where(course.c.id == course_id)))
+            return query.order_by(content.c.id), lambda row: {
+                'type': 'course_content',
+                'id': row.id,
+                'content_hash': row.content_hash,
+                'content': row.content,
+                'chunks': json.loads(row.chunks_json),
+                'created_at': _isoformat(row.created_at),
+            }
+
+        if record_type == 'course':
+            query = select(course)
+            if course_id is not None:
+                query = query.where(course.c.id == course_id)
+            return query.order_by(course.c.id), lambda row: {
+                'type': 'course',
+                'id': row.id,
+                'title': row.title,
+                'content': row.content if row.content_id is None else None,
+                'content_hash': row.content_hash,
+                'content_id': row.content_id,
+                'created_at': _isoformat(row.created_at),
+            }
+
+        if record_type == 'quiz':
+            query = select(quiz)
+            if course_id is not None:
+                query = query.where(quiz.c.course_id == course_id)
+            return query.order_by(quiz.c.id), lambda row: {
+                'type': 'quiz',
+                'id': row.id,
+                'course_id': row.course_id,
+                'title': row.title,
+                'difficulty': row.difficulty,
+                'num_questions': row.num_questions,
+                'questions': json.loads(row.questions_json),
+                'created_at': _isoformat(row.created_at),
+            }
+
+        if record_type == 'archived_attempt':
+            query = select(archive)
+            if course_id is not None:
+                query = query.join(quiz, quiz.c.id == archive.c.quiz_id).where(quiz.c.course_id == course_id)
+            return query.order_by(archive.c.id), lambda row: {
+                'type': 'archived_attempt',
+                'id': row.attempt_id,
+                'quiz_id': row.quiz_id,
+                'answers': json.loads(zlib.decompress(row.answers_blob).decode('utf-8')),
+                'score': row.score,
+                'completed_at': _isoformat(row.completed_at),
+                'archived_at': _isoformat(row.archived_at),
+            }
+
+        query = select(attempt)
+        if course_id is not None:
+            query = query.join(quiz, quiz.c.id == attempt.c.quiz_id).where(quiz.c.course_id == course_id)
+        return query.order_by(attempt.c.id), lambda row: {
+            'type': 'attempt',
+            'id': row.id,
+            'quiz_id': row.quiz_id,
+            'answers': json.loads(row.answers_json),
+            'score': row.score,
+            'completed_at': _isoformat(row.completed_at),
+        }
+
+    def _encode(self, record):
+        """Serialize one record as an NDJSON line"""
+        return (json.dumps(record, separators=(',', ':')) + '\n').encode('utf-8')
+
+
+class _Importer:
+    """Buffers import records of one type and inserts them in batches"""
+
+    def __init__(self, batch_size, retention=None):
+        self.batch_size = batch_size
+        self.retention = retention
+        self.id_maps = {record_type: {} for record_type in RECORD_TYPES}
+        self.counts = {record_type: 0 for record_type in RECORD_TYPES}
+        self._batch_type = None
+        self._batch = []
+
+    def read_lines(self, stream):
+        """Read NDJSON records from a binary stream"""
+        for line_number, line in enumerate(stream, 1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError as e:
+                raise ValueError(f"Invalid JSON on line {line_number}: {str(e)}")
+            self.add(record)
+
+    def add(self, record):
+        """Queue one record, flushing the batch when it is full or the type changes"""
+        record_type = record.get('type')
+        if record_type not in RECORD_TYPES:
+            raise ValueError(f"Unknown record type: {record_type!r}")
+        if record_type != self._batch_type or len(self._batch) >= self.batch_size:
+            # Parents must have new ids before children reference them
+            self.flush()
+            self._batch_type = record_type
+        self._batch.append(record)
+
+    def flush(self):
+        """Insert the pending batch"""
+        if not self._batch:
+            return
+        record_type, batch = self._batch_type, self._batch
+        self._batch = []
+        if record_type == 'course_content':
+            self._insert_contents(batch)
+        elif record_type == 'course':
+            self._insert_rows('course', Course.__table__, batch, self._course_row)
+        elif record_type == 'quiz':
+            self._insert_rows('quiz', Quiz.__table__, batch, self._quiz_row)
+        elif record_type == 'archived_attempt':
+            self._insert_archived_attempts(batch)
+        else:
+            rows = self._insert_rows('attempt', QuizAttempt.__table__, batch, self._attempt_row)
+            self._record_rollups(batch, rows)
+
+    def _insert_contents(self, batch):
+        """Insert course content, reusing rows whose hash already exists"""
+        table = CourseContent.__table__
+        hashes = [record['content_hash'] for record in batch]
+        existing = dict(db.session.execute(
+            select(table.c.content_hash, table.c.id).where(table.c.content_hash.in_(hashes))
+        ).all())
+
+        new_records = []
+        for record in batch:
+            if record['content_hash'] in existing:
+                self.id_maps['course_content'][record['id']] = existing[record['content_hash']]
+            elif record['content_hash'] not in {r['content_hash'] for r in new_records}:
+                new_records.append(record)
+
+        rows = [{
+            'content_hash': record['content_hash'],
+            'content': record['content'],
+            'chunks_json': json.dumps(record.get('chunks') or []),
+            'created_at': _parse_datetime(record.get('created_at')),
+        } for record in new_records]
+        if rows:
+            result = db.session.execute(
+                insert(table).returning(table.c.id, table.c.content_hash, sort_by_parameter_order=True), rows
+            )
+            new_ids = {content_hash: new_id for new_id, content_hash in result}
+            existing.update(new_ids)
+            self.counts['course_content'] += len(rows)
+
+        for record in batch:
+            self.id_maps['course_content'][record['id']] = existing[record['content_hash']]
+
+    def _insert_rows(self, record_type, table, batch, to_row):
+        """Insert a batch of rows and remember the new id of each"""
+        rows = [to_row(record) for record in batch]
+        result = db.session.execute(insert(table).returning(table.c.id, sort_by_parameter_order=True), rows)
+        for record, row, (new_id,) in zip(batch, rows, result):
+            self.id_maps[record_type][record['id']] = new_id
+            row['id'] = new_id
+        self.counts[record_type] += len(rows)
+        return rows
+
+    def _insert_archived_attempts(self, batch):
+        """Insert archived attempts under fresh attempt ids"""
+        # Take the ids from quiz_attempt so /quiz_results finds the archived
+        # attempt and no later attempt can be given the same id
+        attempts = QuizAttempt.__table__
+        rows = self._insert_rows('archived_attempt', attempts, batch, self._attempt_row)
+        db.session.execute(delete(attempts).where(attempts.c.id.in_([row['id'] for row in rows])))
+        db.session.execute(insert(QuizAttemptArchive.__table__), [
+            {
+                'attempt_id': row['id'],
+                'quiz_id': row['quiz_id'],
+                'answers_blob': zlib.compress(row['answers_json'].encode('utf-8')),
+                'score': row['score'],
+                'completed_at': row['completed_at'],
+                'archived_at': _parse_datetime(record.get('archived_at')),
+            }
+            for record, row in zip(batch, rows)
+        ])
+        self._record_rollups(batch, rows)
+
+    def _record_rollups(self, batch, rows):
+        """Add imported attempts to the quiz stats"""
+        if self.retention is None:
+            return
+        self.retention.record_attempts(db.session, [
+            {
+                'quiz_id': row['quiz_id'],
+                'answers': record.get('answers') or {},
+                'score': row['score'],
+                'completed_at': row['completed_at'],
+            }
+            for record, row in zip(batch, rows)
+        ])
+
+    def _parent_id(self, record_type, old_id):
+        """Translate an exported parent id to the id it was imported as"""
+        try:
+            return self.id_maps[record_type][old_id]
+        except KeyError:
+            raise ValueError(f"{record_type} {old_id} referenced before it was imported")
+
+    def _course_row(self, record):
+        content_id = record.get('content_id')
+        return {
+            'title': record['title'],
+            'content': record.get('content') or '',
+            'content_hash': record.get('content_hash'),
+            'content_id': self._parent_id('course_content', content_id) if content_id is not None else None,
+            'created_at': _parse_datetime(record.get('created_at')),
+        }
+
+    def _quiz_row(self, record):
+        return {
+            'course_id': self._parent_id('course', record['course_id']),
+            'title': record['title'],
+            'questions_json': json.dumps(record.get('questions') or [], indent=2),
+            'difficulty': record.get('difficulty') or 'medium',
+            'num_questions': record.get('num_questions') or len(record.get('questions') or []),
+            'created_at': _parse_datetime(record.get('created_at')),
+        }
+
+    def _attempt_row(self, record):
+        return {
+            'quiz_id': self._parent_id('quiz', record['quiz_id']),
+            'answers_json': json.dumps(record.get('answers') or {}),
+            'score': record.get('score'),
+            'completed_at': _parse_datetime(record.get('completed_at')),
+        }
+
+
+def _isoformat(value):
+    return value.isoformat() if value else None
+
+
+def _parse_datetime(value):
+    return datetime.fromisoformat(value) if value else datetime.utcnow()
@@ -0,0 +1,69 @@
+import logging
+import random
+
+OUTCOMES = ('accepted', 'duplicate', 'failed')
+
+
+class ChunkSelector:
+    """Choose which content chunk the next question request is built from
+
+    Each chunk's yield is modelled as a Beta distribution over its past
+    accepted versus duplicate/failed questions, and chunks are picked by
+    sampling from it (Thompson sampling). Productive chunks are favoured,
+    chunks with no history still get tried, and every use within the
+    current quiz damps a chunk so one good chunk doesn't produce the whole
+    quiz.
+    """
+
+    def __init__(self, chunks, stats=None, is_thin=None, min_length=20):
+        """
+        Initialize the selector
+
+        Args:
+            chunks (list): Content chunks, indexed by position
+            stats (dict): Past outcome counts per chunk index
+            is_thin (callable): Returns True for chunks too thin to ask about
+            min_length (int): Chunks shorter than this are never used
+        """
+        self.chunks = chunks
+        self.stats = {index: dict(counts) for index, counts in (stats or {}).items()}
+        self.new_counts = {}
+        self.uses = {}
+
+        candidates = [i for i, chunk in enumerate(chunks) if len(chunk.strip()) >= min_length]
+        substantial = [i for i in candidates if not (is_thin and is_thin(chunks[i]))]
+        if candidates and not substantial:
+            # Better to ask about thin chunks than to give up on the course
+            logging.warning("All content chunks are thin, using them anyway")
+            substantial = candidates
+        self.skipped = len(chunks) - len(substantial)
+        self.candidates = substantial
+
+    def has_chunks(self):
+        """Return True if any chunk is worth a request"""
+        return bool(self.candidates)
+
+    def next_chunk(self):
+        """
+        Pick the chunk for the next request
+
+        Returns:
+            tuple: (chunk index, chunk text)
+        """
+        best_index, best_score = None, -1.0
+        for index in self.candidates:
+            counts = self.stats.get(index, {})
+            hits = counts.get('accepted', 0)
+            misses = counts.get('duplicate', 0) + counts.get('failed', 0)
+            score = random.betavariate(hits + 1, misses + 1) / (1 + self.uses.get(index, 0))
+            if score > best_score:
+                best_index, best_score = index, score
+
+        self.uses[best_index] = self.uses.get(best_index, 0) + 1
+        return best_index, self.chunks[best_index]
+
+    def record(self, index, outcome):
+        """Record whether a request on a chunk was accepted, a duplicate or failed"""
+        for counts in (self.stats, self.new_counts):
+            chunk_counts = counts.setdefault(index, {name: 0 for name in OUTCOMES})
+            chunk_counts[outcome] = chunk_counts.get(outcome, 0) + 1
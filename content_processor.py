@@ -1,4 +1,5 @@
 import re
+import hashlib
 import logging
 from typing import List, Dict, Optional
 
@@ -41,6 +42,22 @@ class ContentProcessor:
             logging.error(f"Error processing content: {str(e)}")
             return raw_content.strip()  # Return original content if processing fails
     
+    def content_hash(self, raw_content: str) -> str:
+        """
+        Hash raw course content for duplicate detection
+        
+        Whitespace is collapsed first so re-pasting the same material with
+        different line breaks or indentation still produces the same hash.
+        
+        Args:
+            raw_content (str): Raw course content
+            
+        Returns:
+            str: Hex SHA-256 digest of the normalized content
+        """
+        normalized = re.sub(r'\s+', ' ', raw_content or '').strip()
+        return hashlib.sha256(normalized.encode('utf-8')).hexdigest()
+    
     def _clean_text(self, text: str) -> str:
         """Clean and normalize text"""
         # Remove HTML tags if present
@@ -249,3 +266,16 @@ class ContentProcessor:
             logging.error(f"Error validating content: {str(e)}")
             validation['issues'].append('Validation error')
             return validation
+    
+    def is_too_thin(self, content: str) -> bool:
+        """
+        Check whether content is too thin to generate a question from
+        
+        Args:
+            content (str): Content chunk to check
+            
+        Returns:
+            bool: True if validation finds too little text to work with
+        """
+        issues = self.validate_content(content)['issues']
+        return 'Content too short' in issues or 'Too few words' in issues
@@ -0,0 +1,82 @@
+import json
+import logging
+from typing import Optional, Dict
+
+
+class IncrementalJSONParser:
+    """Find complete JSON objects in text that arrives in pieces.
+
+    The LLM is asked for a single JSON object but often wraps it in prose,
+    code fences or trailing notes that contain braces of their own. Instead
+    of waiting for the full completion and running a greedy regex over it,
+    the parser tracks brace depth (ignoring braces inside JSON strings) as
+    text is fed and decodes an object as soon as it is balanced. Objects are
+    returned one at a time, so a caller that rejects one (an example or a
+    note before the real answer) can keep feeding to get the next.
+    """
+
+    def __init__(self):
+        """Initialize an empty parser"""
+        self.buffer = ''
+        self._pos = 0
+        self._start = None
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+
+    def feed(self, text: str) -> Optional[Dict]:
+        """
+        Add streamed text and return the next complete object, if any
+
+        Feeding an empty string looks for a further object in text that has
+        already arrived.
+
+        Args:
+            text (str): Next piece of the completion
+
+        Returns:
+            dict or None: Decoded object once a balanced one has arrived
+        """
+        if text:
+            self.buffer += text
+        buffer = self.buffer
+
+        while self._pos < len(buffer):
+            char = buffer[self._pos]
+
+            if self._start is None:
+                if char == '{':
+                    self._start = self._pos
+                    self._depth = 1
+            elif self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif char == '\\':
+                    self._escape = True
+                elif char == '"':
+                    self._in_string = False
+            elif char == '"':
+                self._in_string = True
+            elif char == '{':
+                self._depth += 1
+            elif char == '}':
+                self._depth -= 1
+                if self._depth == 0:
+                    start = self._start
+                    candidate = buffer[start:self._pos + 1]
+                    self._start = None
+                    try:
+                        data = json.loads(candidate)
+                    except ValueError:
+                        # Balanced braces in prose, rescan just past the opening
+                        # brace in case the real object is nested inside
+                        logging.debug(f"Skipping non-JSON brace block: {candidate[:80]}")
+                        data = None
+                        self._pos = start
+                    if isinstance(data, dict):
+                        self._pos += 1
+                        return data
+
+            self._pos += 1
+
+        return None
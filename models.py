@@ -1,13 +1,53 @@
 from app import db
 from datetime import datetime
+from difflib import SequenceMatcher
+from sqlalchemy import inspect, text
 import json
+import logging
+import zlib
+
+class CourseContent(db.Model):
+    """Processed course body shared by every course uploaded with the same text"""
+    id = db.Column(db.Integer, primary_key=True)
+    content_hash = db.Column(db.String(64), nullable=False, unique=True, index=True)
+    content = db.Column(db.Text, nullable=False)
+    chunks_json = db.Column(db.Text, nullable=False, default='[]')  # JSON list of content chunks
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    courses = db.relationship('Course', backref='shared_content', lazy=True)
+
+    @property
+    def chunks(self):
+        """Parse chunks from JSON string"""
+        try:
+            return json.loads(self.chunks_json)
+        except:
+            return []
+
+    @chunks.setter
+    def chunks(self, value):
+        """Store chunks as JSON string"""
+        self.chunks_json = json.dumps(value)
+
+    def __repr__(self):
+        return f'<CourseContent {self.content_hash[:12]}>'
 
 class Course(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     title = db.Column(db.String(200), nullable=False)
-    content = db.Column(db.Text, nullable=False)
+    # Only courses created before content sharing keep their own copy here
+    legacy_content = db.Column('content', db.Text, nullable=False, default='')
+    content_hash = db.Column(db.String(64), nullable=True, index=True)
+    content_id = db.Column(db.Integer, db.ForeignKey('course_content.id'), nullable=True, index=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     quizzes = db.relationship('Quiz', backref='course', lazy=True, cascade='all, delete-orphan')
+    chunk_yields = db.relationship('ChunkYield', backref='course', lazy=True, cascade='all, delete-orphan')
+
+    @property
+    def content(self):
+        """Processed course content, shared with identical uploads"""
+        if self.shared_content is not None:
+            return self.shared_content.content
+        return self.legacy_content
 
     def __repr__(self):
         return f'<Course {self.title}>'
@@ -20,6 +60,8 @@ class Quiz(db.Model):
     difficulty = db.Column(db.String(20), nullable=False, default='medium')
     num_questions = db.Column(db.Integer, nullable=False, default=5)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    # Never hand a deleted quiz's id to a new one
+    __table_args__ = {'sqlite_autoincrement': True}
 
     @property
     def questions(self):
@@ -37,13 +79,34 @@ class Quiz(db.Model):
     def __repr__(self):
         return f'<Quiz {self.title}>'
 
+class ChunkYield(db.Model):
+    """How often questions asked about one content chunk of a course were usable"""
+    id = db.Column(db.Integer, primary_key=True)
+    course_id = db.Column(db.Integer, db.ForeignKey('course.id'), nullable=False)
+    chunk_index = db.Column(db.Integer, nullable=False)
+    accepted = db.Column(db.Integer, nullable=False, default=0)
+    duplicate = db.Column(db.Integer, nullable=False, default=0)
+    failed = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    __table_args__ = (db.UniqueConstraint('course_id', 'chunk_index'),)
+
+    @property
+    def requests(self):
+        """Total question requests made for this chunk"""
+        return self.accepted + self.duplicate + self.failed
+
+    def __repr__(self):
+        return f'<ChunkYield {self.course_id}:{self.chunk_index}>'
+
 class QuizAttempt(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     quiz_id = db.Column(db.Integer, db.ForeignKey('quiz.id'), nullable=False, index=True)
     answers_json = db.Column(db.Text, nullable=False)  # JSON string of user answers
     score = db.Column(db.Float, nullable=True)
-    completed_at = db.Column(db.DateTime, default=datetime.utcnow)
+    completed_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
     quiz = db.relationship('Quiz', backref='attempts')
+    # Archived attempts keep their id, so it must never be reused
+    __table_args__ = {'sqlite_autoincrement': True}
 
     @property
     def answers(self):
@@ -60,3 +123,144 @@ class QuizAttempt(db.Model):
 
     def __repr__(self):
         return f'<QuizAttempt {self.id}>'
+
+class QuizAttemptArchive(db.Model):
+    """Attempt moved out of quiz_attempt once it is older than the retention age"""
+    id = db.Column(db.Integer, primary_key=True)
+    attempt_id = db.Column(db.Integer, nullable=False, index=True)  # id it had in quiz_attempt
+    quiz_id = db.Column(db.Integer, db.ForeignKey('quiz.id'), nullable=False, index=True)
+    answers_blob = db.Column(db.LargeBinary, nullable=False)  # zlib-compressed answers JSON
+    score = db.Column(db.Float, nullable=True)
+    completed_at = db.Column(db.DateTime, nullable=True, index=True)
+    archived_at = db.Column(db.DateTime, default=datetime.utcnow)
+    quiz = db.relationship('Quiz')
+
+    @property
+    def answers(self):
+        """Decompress and parse answers"""
+        try:
+            return json.loads(zlib.decompress(self.answers_blob).decode('utf-8'))
+        except:
+            return {}
+
+    def __repr__(self):
+        return f'<QuizAttemptArchive {self.attempt_id}>'
+
+class QuizDailyRollup(db.Model):
+    """Attempt count and score total for one quiz on one day"""
+    id = db.Column(db.Integer, primary_key=True)
+    quiz_id = db.Column(db.Integer, db.ForeignKey('quiz.id'), nullable=False)
+    day = db.Column(db.Date, nullable=False, index=True)
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    score_sum = db.Column(db.Float, nullable=False, default=0.0)
+    __table_args__ = (db.UniqueConstraint('quiz_id', 'day'),)
+
+    def __repr__(self):
+        return f'<QuizDailyRollup {self.quiz_id} {self.day}>'
+
+class QuestionDailyRollup(db.Model):
+    """How many attempts answered one question of a quiz correctly on one day"""
+    id = db.Column(db.Integer, primary_key=True)
+    quiz_id = db.Column(db.Integer, db.ForeignKey('quiz.id'), nullable=False)
+    day = db.Column(db.Date, nullable=False)
+    position = db.Column(db.Integer, nullable=False)
+    correct = db.Column(db.Integer, nullable=False, default=0)
+    __table_args__ = (db.UniqueConstraint('quiz_id', 'day', 'position'),)
+
+    def __repr__(self):
+        return f'<QuestionDailyRollup {self.quiz_id} {self.day} #{self.position}>'
+
+def dialect_insert(connection):
+    """Return the insert construct of the connection's dialect, which supports ON CONFLICT"""
+    # Sessions expose their dialect through the bound engine
+    dialect = connection.dialect if hasattr(connection, 'dialect') else connection.get_bind().dialect
+    if dialect.name == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert
+    return insert
+
+def score_answers(questions, answers):
+    """
+    Mark each question answered correctly or not
+
+    Args:
+        questions (list): Quiz questions
+        answers (dict): User answers keyed by question position as a string
+
+    Returns:
+        tuple: (number of correct answers, list of per-question booleans)
+    """
+    def is_similar(a, b, threshold=0.8):
+        return SequenceMatcher(None, a.lower(), b.lower()).ratio() > threshold
+
+    correct_answers = 0
+    question_correct = []
+    for i, question in enumerate(questions):
+        user_answer = str(answers.get(str(i), '')).strip().lower()
+        correct_answer = str(question.get('correct_answer', '')).strip().lower()
+
+        is_correct = False
+        if question.get('type') == 'multiple_choice':
+            is_correct = user_answer == correct_answer
+        elif question.get('type') == 'true_false':
+            is_correct = user_answer == correct_answer
+        elif question.get('type') == 'short_answer':
+            is_correct = is_similar(user_answer, correct_answer)
+
+        if is_correct:
+            correct_answers += 1
+        question_correct.append(is_correct)
+    return correct_answers, question_correct
+
+def upgrade_schema():
+    """Add columns and indexes that db.create_all() cannot add to existing tables"""
+    inspector = inspect(db.engine)
+    course_columns = {column['name'] for column in inspector.get_columns('course')}
+    statements = []
+    if 'content_hash' not in course_columns:
+        statements.append("ALTER TABLE course ADD COLUMN content_hash VARCHAR(64)")
+    if 'content_id' not in course_columns:
+        statements.append("ALTER TABLE course ADD COLUMN content_id INTEGER REFERENCES course_content (id)")
+    statements += [
+        "CREATE INDEX IF NOT EXISTS ix_course_content_hash ON course (content_hash)",
+        "CREATE INDEX IF NOT EXISTS ix_course_content_id ON course (content_id)",
+        "CREATE INDEX IF NOT EXISTS ix_quiz_attempt_quiz_id ON quiz_attempt (quiz_id)",
+        "CREATE INDEX IF NOT EXISTS ix_quiz_attempt_completed_at ON quiz_attempt (completed_at)",
+    ]
+    with db.engine.begin() as connection:
+        for statement in statements:
+            connection.execute(text(statement))
+        if connection.dialect.name == 'sqlite':
+            _enable_attempt_autoincrement(connection)
+    logging.debug(f"Schema upgrade ran {len(statements)} statements")
+
+def _enable_attempt_autoincrement(connection):
+    """Rebuild a quiz_attempt table created without AUTOINCREMENT
+
+    Without it SQLite reuses the highest id once that row is archived or
+    deleted, and /quiz_results would show a new attempt in place of an
+    archived one. The sequence starts past every archived attempt id.
+    """
+    table_sql = connection.execute(text(
+        "SELECT sql FROM sqlite_master WHERE type = 'table' AND name = 'quiz_attempt'"
+    )).scalar()
+    if not table_sql or 'AUTOINCREMENT' in table_sql.upper():
+        return
+
+    connection.execute(text("DROP INDEX IF EXISTS ix_quiz_attempt_quiz_id"))
+    connection.execute(text("DROP INDEX IF EXISTS ix_quiz_attempt_completed_at"))
+    connection.execute(text("ALTER TABLE quiz_attempt RENAME TO quiz_attempt_old"))
+    QuizAttempt.__table__.create(connection)
+    connection.execute(text(
+        "INSERT INTO quiz_attempt (id, quiz_id, answers_json, score, completed_at) "
+        "SELECT id, quiz_id, answers_json, score, completed_at FROM quiz_attempt_old"
+    ))
+    connection.execute(text("DROP TABLE quiz_attempt_old"))
+    connection.execute(text("DELETE FROM sqlite_sequence WHERE name = 'quiz_attempt'"))
+    connection.execute(text(
+        "INSERT INTO sqlite_sequence (name, seq) SELECT 'quiz_attempt', max("
+        "(SELECT coalesce(max(id), 0) FROM quiz_attempt), "
+        "(SELECT coalesce(max(attempt_id), 0) FROM quiz_attempt_archive))"
+    ))
+    logging.info("Rebuilt quiz_attempt with AUTOINCREMENT ids")
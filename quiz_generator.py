@@ -1,10 +1,48 @@
 import os
 import logging
+import math
 import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 from groq import Groq
-import json
 import re
 from dotenv import load_dotenv
+from json_stream import IncrementalJSONParser
+from chunk_selection import ChunkSelector
+
+
+class LatencyTracker:
+    """Rolling window of completion latencies used to decide when to hedge"""
+    
+    def __init__(self, window=50, min_samples=5, default_delay=3.0):
+        """
+        Initialize the tracker
+        
+        Args:
+            window (int): Number of recent latencies to keep
+            min_samples (int): Samples needed before the percentile is trusted
+            default_delay (float): Hedge delay in seconds until then
+        """
+        self.samples = deque(maxlen=window)
+        self.min_samples = min_samples
+        self.default_delay = default_delay
+        self._lock = threading.Lock()
+    
+    def record(self, seconds):
+        """Record the latency of a finished completion"""
+        with self._lock:
+            self.samples.append(seconds)
+    
+    def percentile(self, pct=95):
+        """Return the given latency percentile, or the default delay"""
+        with self._lock:
+            if len(self.samples) < self.min_samples:
+                return self.default_delay
+            ordered = sorted(self.samples)
+        index = min(len(ordered) - 1, int(math.ceil(pct / 100.0 * len(ordered))) - 1)
+        return ordered[index]
 
 
 class QuizGenerator:
@@ -22,70 +60,231 @@ class QuizGenerator:
             except Exception as e:
                 logging.error(f"Failed to initialize Groq client: {str(e)}")
                 self.client = None
+        
+        # Concurrent, hedged generation settings
+        self.parallelism = max(1, int(os.getenv("QUIZ_GEN_PARALLELISM", "4")))
+        self.speculative_margin = float(os.getenv("QUIZ_SPECULATIVE_MARGIN", "0.2"))
+        self.hedge_budget = float(os.getenv("QUIZ_HEDGE_BUDGET", "0.2"))
+        self.max_attempt_factor = float(os.getenv("QUIZ_MAX_ATTEMPT_FACTOR", "2.0"))
+        self.pool_share = float(os.getenv("QUIZ_POOL_SHARE", "0.5"))
+        self.latency = LatencyTracker(default_delay=float(os.getenv("QUIZ_HEDGE_DELAY", "3.0")))
     
-    def generate_quiz(self, content, num_questions=5, difficulty='medium', question_types=None):
+    def generate_quiz(self, content, num_questions=5, difficulty='medium', question_types=None,
+                      content_chunks=None, question_pool=None, chunk_selector=None):
         """
         Generate a quiz from the given content using Groq API
         
+        Questions are requested concurrently. A few speculative extra requests
+        cover duplicates and parse failures, and a request that runs past the
+        rolling p95 latency gets a duplicate (hedge) whose answer is used if
+        it finishes first.
+        
         Args:
             content (str): Course content to generate quiz from
             num_questions (int): Number of questions to generate
             difficulty (str): Difficulty level (easy, medium, hard)
             question_types (list): Types of questions to include
+            content_chunks (list): Precomputed chunks, split from content if omitted
+            question_pool (list): Questions already generated from the same
+                content; up to QUIZ_POOL_SHARE of the quiz is taken from it and
+                at least one question is always generated
+            chunk_selector (ChunkSelector): Chooses chunks from their past yield and
+                records this quiz's outcomes; built from content_chunks if omitted
             
         Returns:
             list: List of question dictionaries
         """
-        if not self.client:
-            logging.error("Groq client not initialized")
-            return []
-        
         if not question_types:
             question_types = ['multiple_choice', 'true_false', 'short_answer']
         
+        pool_limit = min(int(num_questions * self.pool_share), num_questions - 1)
+        questions = self._questions_from_pool(question_pool, pool_limit, question_types)
+        
+        if not self.client:
+            logging.error("Groq client not initialized")
+            return questions
+        
         try:
             logging.info(f"Starting quiz generation: {num_questions} questions, difficulty: {difficulty}")
+            if questions:
+                logging.info(f"Reusing {len(questions)} questions from the shared question pool")
             
-            # Create a diverse set of questions by using different prompts and techniques
-            questions = []
+            if chunk_selector is None:
+                # Split content into meaningful chunks
+                if not content_chunks:
+                    content_chunks = self._split_content(content, num_questions)
+                chunk_selector = ChunkSelector(content_chunks or [])
             
-            # Split content into meaningful chunks
-            content_chunks = self._split_content(content, num_questions)
-            if not content_chunks:
-                logging.error("No content chunks available")
-                return []
+            if not chunk_selector.has_chunks():
+                logging.error("No usable content chunks available")
+                return questions
             
-            # Generate questions more efficiently
-            for i in range(min(num_questions, len(content_chunks) * 2)):  # Limit attempts
-                question_type = random.choice(question_types)
-                chunk = content_chunks[i % len(content_chunks)]
-                
-                # Skip very short chunks
-                if len(chunk.strip()) < 20:
-                    continue
+            margin = max(1, math.ceil(num_questions * self.speculative_margin))
+            max_attempts = math.ceil(num_questions * self.max_attempt_factor) + margin
+            max_hedges = math.ceil(num_questions * self.hedge_budget)
+            
+            executor = ThreadPoolExecutor(max_workers=self.parallelism + max_hedges)
+            try:
+                questions, stats = self._run_requests(
+                    executor, chunk_selector, questions, num_questions, difficulty, question_types,
+                    margin, max_attempts, max_hedges
+                )
+            finally:
+                # Losing requests notice their cancel flag and close their streams
+                executor.shutdown(wait=False, cancel_futures=True)
+            
+            accepted = max(1, stats['accepted'])
+            logging.info(
+                f"Quiz generation completed: {len(questions)} questions generated "
+                f"({stats['requests']} requests, {stats['hedges']} hedges, {stats['hedge_wins']} hedge wins, "
+                f"{stats['duplicates']} duplicates, {stats['failures']} failures, "
+                f"{chunk_selector.skipped} chunks skipped, "
+                f"{stats['requests'] / accepted:.2f} requests per accepted question)"
+            )
+            return questions[:num_questions]
+            
+        except Exception as e:
+            logging.error(f"Error generating quiz: {str(e)}")
+            return []
+    
+    def _run_requests(self, executor, chunk_selector, questions, num_questions, difficulty, question_types,
+                      margin, max_attempts, max_hedges):
+        """
+        Drive concurrent question requests until enough questions are accepted
+        
+        Returns:
+            tuple: (accepted questions, request statistics)
+        """
+        questions = list(questions)
+        stats = {'requests': 0, 'hedges': 0, 'hedge_wins': 0, 'accepted': 0, 'duplicates': 0, 'failures': 0}
+        pending = {}  # future -> slot
+        open_slots = []
+        attempts = 0
+        
+        def launch(slot):
+            future = executor.submit(self._timed_question, slot)
+            pending[future] = slot
+            slot['futures'].append(future)
+            stats['requests'] += 1
+        
+        while len(questions) < num_questions:
+            # Keep enough requests in flight to cover what is still missing
+            # plus the speculative margin
+            wanted = num_questions - len(questions) + margin
+            while len(open_slots) < min(wanted, self.parallelism) and attempts < max_attempts:
+                chunk_index, chunk = chunk_selector.next_chunk()
+                slot = {
+                    'chunk_index': chunk_index,
+                    'chunk': chunk,
+                    'question_type': random.choice(question_types),
+                    'difficulty': difficulty,
+                    # Add randomization elements to ensure variety
+                    'variation_seed': random.randint(1, 1000),
+                    'focus_aspect': random.choice(['concepts', 'details', 'applications', 'examples', 'relationships']),
+                    'cancel': threading.Event(),
+                    'futures': [],
+                    'started': time.monotonic(),
+                    'hedged': False,
+                    'finished': False,
+                }
+                attempts += 1
+                open_slots.append(slot)
+                launch(slot)
+            
+            if not pending:
+                break
+            
+            now = time.monotonic()
+            hedge_delay = self.latency.percentile(95)
+            deadlines = [
+                slot['started'] + hedge_delay - now
+                for slot in open_slots
+                if not slot['hedged'] and stats['hedges'] < max_hedges
+            ]
+            timeout = max(0.0, min(deadlines)) if deadlines else None
+            
+            done, _ = wait(list(pending), timeout=timeout, return_when=FIRST_COMPLETED)
+            
+            for future in done:
+                slot = pending.pop(future)
+                if slot['finished']:
+                    continue  # the other copy already answered
                 
-                # Add randomization elements to ensure variety
-                variation_seed = random.randint(1, 1000)
-                focus_aspect = random.choice(['concepts', 'details', 'applications', 'examples', 'relationships'])
+                question = future.result()
+                if question is None and not all(f.done() for f in slot['futures']):
+                    continue  # a hedge for this slot may still succeed
                 
-                question = self._generate_single_question(
-                    chunk, question_type, difficulty, variation_seed, focus_aspect
-                )
+                slot['finished'] = True
+                slot['cancel'].set()
+                if question is None:
+                    stats['failures'] += 1
+                    chunk_selector.record(slot['chunk_index'], 'failed')
+                    continue
+                if future is not slot['futures'][0]:
+                    stats['hedge_wins'] += 1
                 
-                if question and not self._is_duplicate_question(question, questions):
+                if self._is_duplicate_question(question, questions):
+                    stats['duplicates'] += 1
+                    chunk_selector.record(slot['chunk_index'], 'duplicate')
+                elif len(questions) < num_questions:
+                    stats['accepted'] += 1
+                    chunk_selector.record(slot['chunk_index'], 'accepted')
                     questions.append(question)
                     logging.info(f"Generated question {len(questions)}/{num_questions}")
-                    
-                    # Stop if we have enough questions
-                    if len(questions) >= num_questions:
-                        break
             
-            logging.info(f"Quiz generation completed: {len(questions)} questions generated")
-            return questions[:num_questions]
+            open_slots = [slot for slot in open_slots if not slot['finished']]
             
-        except Exception as e:
-            logging.error(f"Error generating quiz: {str(e)}")
+            # Hedge requests that have run past the rolling p95
+            now = time.monotonic()
+            for slot in open_slots:
+                if stats['hedges'] >= max_hedges:
+                    break
+                if not slot['hedged'] and now - slot['started'] >= hedge_delay:
+                    slot['hedged'] = True
+                    stats['hedges'] += 1
+                    logging.debug(f"Hedging request after {now - slot['started']:.2f}s (p95 {hedge_delay:.2f}s)")
+                    launch(slot)
+        
+        # Stop speculative requests that are no longer needed
+        for slot in open_slots:
+            slot['cancel'].set()
+        
+        return questions, stats
+    
+    def _timed_question(self, slot):
+        """Generate the question for a slot and record how long it took"""
+        start_time = time.monotonic()
+        question = self._generate_single_question(
+            slot['chunk'], slot['question_type'], slot['difficulty'],
+            slot['variation_seed'], slot['focus_aspect'], cancel_event=slot['cancel']
+        )
+        if question is not None:
+            self.latency.record(time.monotonic() - start_time)
+        return question
+    
+    def _questions_from_pool(self, question_pool, num_questions, question_types):
+        """Pick distinct questions of the requested types from a shared pool
+
+        Picked questions are marked from_pool so they never go back into a pool.
+        """
+        if not question_pool or num_questions <= 0:
             return []
+        
+        candidates = [q for q in question_pool if q.get('type') in question_types]
+        random.shuffle(candidates)
+        
+        questions = []
+        for question in candidates:
+            if len(questions) >= num_questions:
+                break
+            if not self._is_duplicate_question(question, questions):
+                questions.append(dict(question, from_pool=True))
+        return questions
+    
+    def split_content(self, content, num_chunks=20):
+        """Split content into the stable chunk list stored with shared course content"""
+        sentence_count = len([s for s in re.split(r'[.!?]+', content) if s.strip()])
+        return self._split_content(content, max(1, min(num_chunks, sentence_count)))
     
     def _split_content(self, content, num_questions):
         """Split content into chunks for varied question generation"""
@@ -105,12 +304,13 @@ class QuizGenerator:
         
         return chunks if chunks else [content]
     
-    def _generate_single_question(self, content, question_type, difficulty, variation_seed, focus_aspect):
-        """Generate a single question using Groq API"""
+    def _generate_single_question(self, content, question_type, difficulty, variation_seed, focus_aspect,
+                                  cancel_event=None):
+        """Generate a single question using Groq API, giving up early if cancel_event is set"""
         try:
             prompt = self._create_prompt(content, question_type, difficulty, variation_seed, focus_aspect)
             
-            response = self.client.chat.completions.create(
+            stream = self.client.chat.completions.create(
                 messages=[
                     {
                         "role": "system",
@@ -124,25 +324,88 @@ class QuizGenerator:
                 model="llama3-8b-8192",  # Using Llama3 model on Groq
                 temperature=0.7,  # Balanced temperature for quality and speed
                 max_tokens=500,  # Reduced for faster responses
-                top_p=0.8
+                top_p=0.8,
+                stream=True
             )
             
-            response_text = response.choices[0].message.content.strip()
+            # Parse the completion as it streams and stop reading as soon as
+            # one balanced object that passes validation has arrived
+            parser = IncrementalJSONParser()
+            question_data = None
+            errors = []
+            try:
+                for chunk in stream:
+                    if cancel_event is not None and cancel_event.is_set():
+                        return None
+                    if not chunk.choices:
+                        continue
+                    candidate = parser.feed(chunk.choices[0].delta.content)
+                    while candidate is not None:
+                        errors = self._validate_question(candidate, question_type)
+                        if not errors:
+                            question_data = candidate
+                            break
+                        # Possibly an example or note, the question may follow
+                        logging.debug(f"Skipping streamed object: {'; '.join(errors)}")
+                        candidate = parser.feed('')
+                    if question_data is not None:
+                        break
+            finally:
+                stream.close()
             
-            # Extract JSON from response
-            json_match = re.search(r'\{.*\}', response_text, re.DOTALL)
-            if json_match:
-                question_data = json.loads(json_match.group())
-                question_data['type'] = question_type
-                return question_data
-            else:
-                logging.error(f"No valid JSON found in response: {response_text}")
+            if question_data is None:
+                if errors:
+                    logging.warning(f"Discarding {question_type} question: {'; '.join(errors)}")
+                else:
+                    logging.error(f"No valid JSON found in response: {parser.buffer}")
                 return None
+            
+            question_data['type'] = question_type
+            return question_data
                 
         except Exception as e:
             logging.error(f"Error generating single question: {str(e)}")
             return None
     
+    def _validate_question(self, question_data, question_type):
+        """
+        Check a parsed question against the structure requested in the prompt
+        
+        Args:
+            question_data (dict): Parsed question object
+            question_type (str): Requested question type
+            
+        Returns:
+            list: Schema errors, empty when the question is usable
+        """
+        errors = []
+        
+        question = question_data.get('question')
+        if not isinstance(question, str) or not question.strip():
+            errors.append("missing question text")
+        
+        correct_answer = question_data.get('correct_answer')
+        if not isinstance(correct_answer, str) or not correct_answer.strip():
+            errors.append("missing correct_answer")
+            return errors
+        
+        explanation = question_data.get('explanation')
+        if explanation is not None and not isinstance(explanation, str):
+            errors.append("explanation is not a string")
+        
+        answer = correct_answer.strip().lower()
+        if question_type == 'multiple_choice':
+            options = question_data.get('options')
+            if not isinstance(options, list) or len(options) < 2 or not all(isinstance(o, str) for o in options):
+                errors.append("options must be a list of strings")
+            elif len(answer) != 1 or answer not in 'abcdefgh'[:len(options)]:
+                errors.append(f"correct_answer {correct_answer!r} does not match an option")
+        elif question_type == 'true_false':
+            if answer not in ('true', 'false'):
+                errors.append(f"correct_answer {correct_answer!r} is not true/false")
+        
+        return errors
+    
     def _create_prompt(self, content, question_type, difficulty, variation_seed, focus_aspect):
         """Create a prompt for question generation"""
         base_prompt = f"""
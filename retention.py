@@ -0,0 +1,267 @@
+import json
+import logging
+import zlib
+from datetime import datetime, timedelta
+
+from sqlalchemy import delete, func, insert, select
+
+from app import db
+from models import (
+    Quiz, QuizAttempt, QuizAttemptArchive, QuizDailyRollup, QuestionDailyRollup, dialect_insert, score_answers
+)
+
+
+class AttemptRetention:
+    def __init__(self, max_age_days=90, batch_size=500):
+        """
+        Initialize the AttemptRetention
+
+        Args:
+            max_age_days (int): Attempts older than this are moved to the archive
+            batch_size (int): Attempts archived per transaction or rescored per batch
+        """
+        self.max_age_days = max_age_days
+        self.batch_size = batch_size
+
+    def record(self, connection, quiz_id, completed_at, score, question_correct):
+        """
+        Add one attempt to the daily rollups
+
+        Runs on the caller's connection or session so the rollup commits
+        together with the attempt. Rows are upserted with a single statement
+        each, so concurrent submissions never lose an increment.
+
+        Args:
+            connection: Connection or session to execute on
+            quiz_id (int): Quiz the attempt belongs to
+            completed_at (datetime): When the attempt was submitted
+            score (float): Attempt score in percent
+            question_correct (list): Whether each question was answered correctly
+        """
+        day = completed_at.date()
+        self._upsert_rollups(
+            connection,
+            {(quiz_id, day): (1, score or 0.0)},
+            {(quiz_id, day, position): int(bool(correct)) for position, correct in enumerate(question_correct)},
+        )
+
+    def record_attempts(self, connection, attempts):
+        """
+        Add a batch of stored attempts to the daily rollups
+
+        Used for imported attempts and when rebuilding the rollups. Each
+        attempt is re-scored per question against its quiz's questions.
+
+        Args:
+            connection: Connection or session to execute on
+            attempts (list): Dicts with quiz_id, answers, score and completed_at
+        """
+        quiz_table = Quiz.__table__
+        quiz_ids = {attempt['quiz_id'] for attempt in attempts}
+        questions_by_quiz = {}
+        for quiz_id, questions_json in connection.execute(
+            select(quiz_table.c.id, quiz_table.c.questions_json).where(quiz_table.c.id.in_(quiz_ids))
+        ):
+            try:
+                questions_by_quiz[quiz_id] = json.loads(questions_json)
+            except ValueError:
+                questions_by_quiz[quiz_id] = []
+
+        quiz_totals = {}
+        question_totals = {}
+        for attempt in attempts:
+            quiz_id = attempt['quiz_id']
+            day = (attempt['completed_at'] or datetime.utcnow()).date()
+            _, question_correct = score_answers(questions_by_quiz.get(quiz_id, []), attempt['answers'])
+
+            count, score_sum = quiz_totals.get((quiz_id, day), (0, 0.0))
+            quiz_totals[(quiz_id, day)] = (count + 1, score_sum + (attempt['score'] or 0.0))
+            for position, correct in enumerate(question_correct):
+                key = (quiz_id, day, position)
+                question_totals[key] = question_totals.get(key, 0) + int(correct)
+
+        self._upsert_rollups(connection, quiz_totals, question_totals)
+
+    def ensure_rollups(self):
+        """Fill the daily rollups from stored attempts if they have never been built"""
+        def has_rows(model):
+            return db.session.execute(select(model.__table__.c.id).limit(1)).first() is not None
+
+        if has_rows(QuizDailyRollup) or not (has_rows(QuizAttempt) or has_rows(QuizAttemptArchive)):
+            return
+        logging.info("Quiz rollups are empty, building them from stored attempts")
+        self.rebuild_rollups()
+
+    def rebuild_rollups(self):
+        """
+        Recompute the daily rollups from quiz_attempt and the archive
+
+        Runs in one transaction, so stats never show a half-built state.
+
+        Returns:
+            int: Number of attempts counted
+        """
+        db.session.execute(delete(QuizDailyRollup.__table__))
+        db.session.execute(delete(QuestionDailyRollup.__table__))
+
+        counted = 0
+        for model in (QuizAttempt, QuizAttemptArchive):
+            last_id = 0
+            while True:
+                rows = db.session.scalars(
+                    select(model).where(model.id > last_id).order_by(model.id).limit(self.batch_size)
+                ).all()
+                if not rows:
+                    break
+                self.record_attempts(db.session, [
+                    {'quiz_id': row.quiz_id, 'answers': row.answers, 'score': row.score, 'completed_at': row.completed_at}
+                    for row in rows
+                ])
+                last_id = rows[-1].id
+                counted += len(rows)
+                # Keep memory flat on large histories
+                db.session.expunge_all()
+
+        db.session.commit()
+        logging.info(f"Rebuilt quiz rollups from {counted} attempts")
+        return counted
+
+    def remove_quizzes(self, quiz_ids):
+        """
+        Delete the attempts, archived attempts and rollups of quizzes being deleted
+
+        Runs on db.session so it commits together with the quiz deletion.
+
+        Args:
+            quiz_ids (list): Ids of the quizzes
+        """
+        if not quiz_ids:
+            return
+        for model in (QuizAttempt, QuizAttemptArchive, QuizDailyRollup, QuestionDailyRollup):
+            db.session.execute(delete(model.__table__).where(model.__table__.c.quiz_id.in_(quiz_ids)))
+
+    def archive(self, max_age_days=None):
+        """
+        Move attempts older than the retention age into the archive table
+
+        Each batch is copied and deleted in its own transaction, so an
+        interrupted run leaves every attempt in exactly one of the tables.
+
+        Args:
+            max_age_days (int): Override the configured retention age
+
+        Returns:
+            int: Number of attempts archived
+        """
+        age = self.max_age_days if max_age_days is None else max_age_days
+        cutoff = datetime.utcnow() - timedelta(days=age)
+        attempts = QuizAttempt.__table__
+        archive = QuizAttemptArchive.__table__
+        archived = 0
+
+        while True:
+            rows = db.session.execute(
+                select(attempts)
+                .where(attempts.c.completed_at < cutoff)
+                .order_by(attempts.c.completed_at)
+                .limit(self.batch_size)
+            ).all()
+            if not rows:
+                break
+
+            db.session.execute(insert(archive), [
+                {
+                    'attempt_id': row.id,
+                    'quiz_id': row.quiz_id,
+                    'answers_blob': zlib.compress(row.answers_json.encode('utf-8')),
+                    'score': row.score,
+                    'completed_at': row.completed_at,
+                    'archived_at': datetime.utcnow(),
+                }
+                for row in rows
+            ])
+            db.session.execute(delete(attempts).where(attempts.c.id.in_([row.id for row in rows])))
+            db.session.commit()
+            archived += len(rows)
+
+        logging.info(f"Archived {archived} quiz attempts older than {age} days")
+        return archived
+
+    def quiz_stats(self, quiz_id, days=None):
+        """
+        Summarize a quiz's attempts from the daily rollups
+
+        Args:
+            quiz_id (int): Quiz to summarize
+            days (int): Only include the most recent days, or None for all time
+
+        Returns:
+            dict: Per-day attempts and average score, and per-question correct rates
+        """
+        rollup_query = QuizDailyRollup.query.filter_by(quiz_id=quiz_id)
+        question_query = db.session.query(
+            QuestionDailyRollup.position, func.sum(QuestionDailyRollup.correct)
+        ).filter(QuestionDailyRollup.quiz_id == quiz_id)
+        if days is not None:
+            since = datetime.utcnow().date() - timedelta(days=days)
+            rollup_query = rollup_query.filter(QuizDailyRollup.day >= since)
+            question_query = question_query.filter(QuestionDailyRollup.day >= since)
+
+        daily = rollup_query.order_by(QuizDailyRollup.day).all()
+        total_attempts = sum(row.attempts for row in daily)
+        correct_by_position = dict(question_query.group_by(QuestionDailyRollup.position).all())
+
+        return {
+            'quiz_id': quiz_id,
+            'attempts': total_attempts,
+            'average_score': sum(row.score_sum for row in daily) / total_attempts if total_attempts else None,
+            'daily': [
+                {'day': row.day.isoformat(), 'attempts': row.attempts, 'average_score': row.score_sum / row.attempts}
+                for row in daily if row.attempts
+            ],
+            'questions': [
+                {'position': position, 'correct': correct, 'correct_rate': correct / total_attempts if total_attempts else None}
+                for position, correct in sorted(correct_by_position.items())
+            ],
+        }
+
+    def _upsert_rollups(self, connection, quiz_totals, question_totals):
+        """
+        Add counts to the rollup rows, creating rows that don't exist yet
+
+        Each table is upserted with a single statement, so concurrent
+        writers never lose an increment.
+
+        Args:
+            connection: Connection or session to execute on
+            quiz_totals (dict): (attempts, score sum) per (quiz_id, day)
+            question_totals (dict): Correct answers per (quiz_id, day, position)
+        """
+        upsert = dialect_insert(connection)
+
+        rollup = QuizDailyRollup.__table__
+        rows = [
+            {'quiz_id': quiz_id, 'day': day, 'attempts': attempts, 'score_sum': score_sum}
+            for (quiz_id, day), (attempts, score_sum) in quiz_totals.items()
+        ]
+        if rows:
+            statement = upsert(rollup)
+            connection.execute(statement.on_conflict_do_update(
+                index_elements=['quiz_id', 'day'],
+                set_={
+                    'attempts': rollup.c.attempts + statement.excluded.attempts,
+                    'score_sum': rollup.c.score_sum + statement.excluded.score_sum,
+                }
+            ), rows)
+
+        questions = QuestionDailyRollup.__table__
+        rows = [
+            {'quiz_id': quiz_id, 'day': day, 'position': position, 'correct': correct}
+            for (quiz_id, day, position), correct in question_totals.items()
+        ]
+        if rows:
+            statement = upsert(questions)
+            connection.execute(statement.on_conflict_do_update(
+                index_elements=['quiz_id', 'day', 'position'],
+                set_={'correct': questions.c.correct + statement.excluded.correct}
+            ), rows)
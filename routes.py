@@ -1,8 +1,15 @@
-from flask import render_template, request, redirect, url_for, flash, jsonify, make_response
+from flask import render_template, request, redirect, url_for, flash, jsonify, make_response, Response, stream_with_context
 from app import app, db
-from models import Course, Quiz, QuizAttempt
+from models import Course, CourseContent, ChunkYield, Quiz, QuizAttempt, QuizAttemptArchive, dialect_insert, score_answers
+from sqlalchemy.exc import IntegrityError
 from quiz_generator import QuizGenerator
 from content_processor import ContentProcessor
+from chunk_selection import ChunkSelector
+from bulk_transfer import BulkTransfer
+from search_index import SearchIndex
+from retention import AttemptRetention
+from datetime import datetime
+import click
 import json
 import logging
 import time
@@ -10,6 +17,9 @@ import time
 # Initialize components
 quiz_generator = QuizGenerator()
 content_processor = ContentProcessor()
+search_index = SearchIndex()
+attempt_retention = AttemptRetention(max_age_days=app.config["ATTEMPT_RETENTION_DAYS"])
+bulk_transfer = BulkTransfer(search_index=search_index, retention=attempt_retention)
 
 @app.route('/')
 def index():
@@ -33,15 +43,23 @@ def upload_course():
             flash('Course content is too short. Please provide at least 100 characters.', 'error')
             return redirect(url_for('index'))
         
-        # Process and validate content
-        processed_content = content_processor.process_content(content)
-        if not processed_content:
-            flash('Unable to process the course content. Please check the format and try again.', 'error')
-            return redirect(url_for('index'))
+        # Identical material is processed and stored once, then shared
+        content_hash = content_processor.content_hash(content)
+        shared_content = CourseContent.query.filter_by(content_hash=content_hash).first()
+        if shared_content:
+            logging.info(f"Reusing processed content {content_hash[:12]} for course \"{title}\"")
+        else:
+            processed_content = content_processor.process_content(content)
+            if not processed_content:
+                flash('Unable to process the course content. Please check the format and try again.', 'error')
+                return redirect(url_for('index'))
+            shared_content = _store_course_content(content_hash, processed_content)
         
         # Save course to database
-        course = Course(title=title, content=processed_content)
+        course = Course(title=title, content_hash=content_hash, shared_content=shared_content)
         db.session.add(course)
+        db.session.flush()
+        search_index.index_course(course)
         db.session.commit()
         
         flash(f'Course "{title}" uploaded successfully!', 'success')
@@ -52,6 +70,83 @@ def upload_course():
         flash('An error occurred while uploading the course. Please try again.', 'error')
         return redirect(url_for('index'))
 
+def _store_course_content(content_hash, processed_content):
+    """Save processed content, or return the row a concurrent upload just saved"""
+    shared_content = CourseContent(content_hash=content_hash, content=processed_content)
+    shared_content.chunks = quiz_generator.split_content(processed_content)
+    db.session.add(shared_content)
+    try:
+        db.session.commit()
+    except IntegrityError:
+        db.session.rollback()
+        shared_content = CourseContent.query.filter_by(content_hash=content_hash).one()
+    return shared_content
+
+def _shared_question_pool(course, difficulty):
+    """
+    Distinct questions generated for other courses with the same content
+
+    Questions that were themselves served from the pool are left out, so
+    copies never circulate back, and so are questions the course already
+    has in its own quizzes.
+    """
+    if not course.content_id:
+        return []
+    
+    sibling_quizzes = Quiz.query.join(Course).filter(
+        Course.content_id == course.content_id,
+        Course.id != course.id,
+        Quiz.difficulty == difficulty
+    ).all()
+    
+    seen = {_question_key(question) for quiz in course.quizzes for question in quiz.questions}
+    pool = []
+    for quiz in sibling_quizzes:
+        for question in quiz.questions:
+            if not isinstance(question, dict) or question.get('from_pool'):
+                continue
+            key = _question_key(question)
+            if key not in seen:
+                seen.add(key)
+                pool.append(question)
+    return pool
+
+def _question_key(question):
+    """Question text normalized for comparing questions across quizzes"""
+    text = question.get('question', '') if isinstance(question, dict) else ''
+    return ' '.join(str(text).lower().split())
+
+def _load_chunk_yields(course):
+    """Past per-chunk outcome counts for a course, keyed by chunk index"""
+    return {
+        row.chunk_index: {'accepted': row.accepted, 'duplicate': row.duplicate, 'failed': row.failed}
+        for row in ChunkYield.query.filter_by(course_id=course.id)
+    }
+
+def _save_chunk_yields(course, chunk_selector):
+    """Add the outcomes recorded while generating a quiz to the stored counts"""
+    rows = [
+        {'course_id': course.id, 'chunk_index': chunk_index, 'accepted': counts['accepted'],
+         'duplicate': counts['duplicate'], 'failed': counts['failed'], 'updated_at': datetime.utcnow()}
+        for chunk_index, counts in chunk_selector.new_counts.items()
+    ]
+    if not rows:
+        return
+    
+    # One upsert per chunk, so concurrent generations for a course add up
+    # instead of racing to create or overwrite the same row
+    table = ChunkYield.__table__
+    statement = dialect_insert(db.session)(table)
+    db.session.execute(statement.on_conflict_do_update(
+        index_elements=['course_id', 'chunk_index'],
+        set_={
+            'accepted': table.c.accepted + statement.excluded.accepted,
+            'duplicate': table.c.duplicate + statement.excluded.duplicate,
+            'failed': table.c.failed + statement.excluded.failed,
+            'updated_at': statement.excluded.updated_at,
+        }
+    ), rows)
+
 @app.route('/course/<int:course_id>')
 def course_detail(course_id):
     """Display course details and quiz generation options"""
@@ -86,14 +181,26 @@ def generate_quiz():
             question_types = ['multiple_choice', 'true_false', 'short_answer']
         
         # Generate quiz questions
+        shared_content = course.shared_content
+        content_chunks = shared_content.chunks if shared_content else quiz_generator.split_content(course.content)
+        chunk_selector = ChunkSelector(
+            content_chunks,
+            stats=_load_chunk_yields(course),
+            is_thin=content_processor.is_too_thin
+        )
         questions = quiz_generator.generate_quiz(
             course.content, 
             num_questions=num_questions,
             difficulty=difficulty,
-            question_types=question_types
+            question_types=question_types,
+            question_pool=_shared_question_pool(course, difficulty),
+            chunk_selector=chunk_selector
         )
         
+        _save_chunk_yields(course, chunk_selector)
+        
         if not questions:
+            db.session.commit()
             flash('Unable to generate quiz questions. Please check your course content and try again.', 'error')
             return redirect(url_for('course_detail', course_id=course_id))
         
@@ -108,6 +215,8 @@ def generate_quiz():
         quiz.questions = questions
         
         db.session.add(quiz)
+        db.session.flush()
+        search_index.index_quiz(quiz)
         db.session.commit()
         
         flash(f'Quiz generated successfully with {len(questions)} questions!', 'success')
@@ -118,6 +227,36 @@ def generate_quiz():
         flash('An error occurred while generating the quiz. Please try again.', 'error')
         return redirect(url_for('index'))
 
+@app.route('/course/<int:course_id>/chunk_stats')
+def chunk_stats(course_id):
+    """Per-chunk question yield for a course"""
+    course = Course.query.get_or_404(course_id)
+    rows = ChunkYield.query.filter_by(course_id=course_id).order_by(ChunkYield.chunk_index).all()
+    
+    totals = {
+        'accepted': sum(row.accepted for row in rows),
+        'duplicate': sum(row.duplicate for row in rows),
+        'failed': sum(row.failed for row in rows),
+    }
+    requests_made = sum(totals.values())
+    totals['requests'] = requests_made
+    totals['requests_per_accepted'] = requests_made / totals['accepted'] if totals['accepted'] else None
+    
+    return jsonify({
+        'course_id': course.id,
+        'totals': totals,
+        'chunks': [
+            {
+                'chunk_index': row.chunk_index,
+                'accepted': row.accepted,
+                'duplicate': row.duplicate,
+                'failed': row.failed,
+                'yield': row.accepted / row.requests if row.requests else None
+            }
+            for row in rows
+        ]
+    })
+
 @app.route('/quiz/<int:quiz_id>')
 def take_quiz(quiz_id):
     """Display quiz for taking"""
@@ -145,30 +284,13 @@ def submit_quiz():
         # Calculate score
         questions = quiz.questions
         import logging
-        from difflib import SequenceMatcher
 
         logging.basicConfig(level=logging.DEBUG)
 
         total_questions = len(questions)
-        correct_answers = 0
-
-        def is_similar(a, b, threshold=0.8):
-            return SequenceMatcher(None, a.lower(), b.lower()).ratio() > threshold
 
         start_time = time.time()
-        for i, question in enumerate(questions):
-            user_answer = answers.get(str(i), '').strip().lower()
-            correct_answer = question.get('correct_answer', '').strip().lower()
-    
-            if question['type'] == 'multiple_choice':
-                if user_answer == correct_answer:
-                    correct_answers += 1
-            elif question['type'] == 'true_false':
-                if user_answer == correct_answer:
-                    correct_answers += 1
-            elif question['type'] == 'short_answer':
-                    if is_similar(user_answer, correct_answer):
-                        correct_answers += 1
+        correct_answers, question_correct = score_answers(questions, answers)
 
         logging.debug(f"Scoring took {time.time() - start_time} seconds for {total_questions} questions")
         
@@ -178,17 +300,32 @@ def submit_quiz():
         # Save quiz attempt
         attempt = QuizAttempt(
             quiz_id=quiz_id,
-            score=score
+            score=score,
+            completed_at=datetime.utcnow()
         )
         attempt.answers = answers
 
+        def record_rollup(connection, row_id=None):
+            attempt_retention.record(connection, quiz_id, attempt.completed_at, score, question_correct)
+
         db_start_time = time.time()
-        db.session.add(attempt)
-        db.session.commit()
+        attempt_writer = app.extensions.get('attempt_writer')
+        if attempt_writer:
+            attempt_id = attempt_writer.submit({
+                'quiz_id': attempt.quiz_id,
+                'answers_json': attempt.answers_json,
+                'score': attempt.score,
+                'completed_at': attempt.completed_at
+            }, on_insert=record_rollup)
+        else:
+            db.session.add(attempt)
+            record_rollup(db.session)
+            db.session.commit()
+            attempt_id = attempt.id
         logging.debug(f"Database commit took {time.time() - db_start_time} seconds")
 
         flash(f'Quiz completed! Your score: {score:.1f}% ({correct_answers}/{total_questions})', 'success')
-        return redirect(url_for('quiz_results', attempt_id=attempt.id))
+        return redirect(url_for('quiz_results', attempt_id=attempt_id))
         
         
     except Exception as e:
@@ -199,9 +336,20 @@ def submit_quiz():
 @app.route('/quiz_results/<int:attempt_id>')
 def quiz_results(attempt_id):
     """Display quiz results"""
-    attempt = QuizAttempt.query.get_or_404(attempt_id)
+    attempt = QuizAttempt.query.get(attempt_id)
+    if attempt is None:
+        # Old attempts live on in the archive
+        attempt = QuizAttemptArchive.query.filter_by(attempt_id=attempt_id).order_by(
+            QuizAttemptArchive.id.desc()).first_or_404()
     return render_template('quiz_display.html', quiz=attempt.quiz, attempt=attempt, show_results=True)
 
+@app.route('/quiz/<int:quiz_id>/stats')
+def quiz_stats(quiz_id):
+    """Long-term attempt statistics for a quiz, read from the daily rollups"""
+    Quiz.query.get_or_404(quiz_id)
+    days = request.args.get('days', type=int)
+    return jsonify(attempt_retention.quiz_stats(quiz_id, days=days))
+
 @app.route('/quiz_history')
 def quiz_history():
     """Display quiz history"""
@@ -228,14 +376,82 @@ def export_quiz(quiz_id):
     
     return response
 
+@app.route('/export')
+def bulk_export():
+    """Stream courses, quizzes and attempts as NDJSON or a zip of NDJSON files"""
+    course_id = request.args.get('course_id', type=int)
+    export_format = request.args.get('format', 'ndjson')
+    
+    if course_id is not None:
+        Course.query.get_or_404(course_id)
+    basename = f'course_{course_id}' if course_id is not None else 'quiz_app'
+    
+    if export_format == 'zip':
+        body = bulk_transfer.export_zip(course_id)
+        mimetype = 'application/zip'
+        filename = f'{basename}.zip'
+    else:
+        body = bulk_transfer.export_ndjson(course_id)
+        mimetype = 'application/x-ndjson'
+        filename = f'{basename}.ndjson'
+    
+    response = Response(stream_with_context(body), mimetype=mimetype)
+    response.headers['Content-Disposition'] = f'attachment; filename={filename}'
+    return response
+
+@app.route('/import', methods=['POST'])
+def bulk_import():
+    """Import an NDJSON file or zip archive produced by /export"""
+    try:
+        upload = request.files.get('file')
+        if not upload or not upload.filename:
+            flash('Please choose an export file to import.', 'error')
+            return redirect(url_for('index'))
+        
+        counts = bulk_transfer.import_stream(upload.stream, upload.filename)
+        
+        flash(f"Imported {counts['course']} courses, {counts['quiz']} quizzes and {counts['attempt']} attempts.", 'success')
+        return redirect(url_for('index'))
+        
+    except Exception as e:
+        logging.error(f"Error importing data: {str(e)}")
+        flash('An error occurred while importing. Please check the file and try again.', 'error')
+        return redirect(url_for('index'))
+
+@app.route('/search')
+def search():
+    """Ranked full-text search over courses and generated questions"""
+    query = request.args.get('q', '').strip()
+    kind = request.args.get('type', 'all')
+    page = max(1, request.args.get('page', 1, type=int))
+    per_page = min(100, max(1, request.args.get('per_page', 20, type=int)))
+    
+    if not search_index.enabled:
+        return jsonify({'error': 'Search is not available for this database'}), 501
+    if kind not in ('all', 'courses', 'questions'):
+        kind = 'all'
+    
+    results = search_index.search(query, kind=kind, page=page, per_page=per_page)
+    return jsonify({'query': query, 'page': page, 'per_page': per_page, **results})
+
 @app.route('/delete_course/<int:course_id>', methods=['POST'])
 def delete_course(course_id):
     """Delete a course and all its quizzes"""
     try:
         course = Course.query.get_or_404(course_id)
         course_title = course.title
+        shared_content = course.shared_content
         
+        quiz_ids = [quiz.id for quiz in course.quizzes]
+        search_index.remove_course(course.id, quiz_ids)
+        attempt_retention.remove_quizzes(quiz_ids)
         db.session.delete(course)
+        db.session.flush()
+        
+        # Drop the shared body once no course uses it
+        if shared_content and not Course.query.filter_by(content_id=shared_content.id).count():
+            search_index.remove_content(shared_content.id)
+            db.session.delete(shared_content)
         db.session.commit()
         
         flash(f'Course "{course_title}" and all its quizzes have been deleted.', 'success')
@@ -246,6 +462,19 @@ def delete_course(course_id):
         flash('An error occurred while deleting the course.', 'error')
         return redirect(url_for('index'))
 
+@app.cli.command('archive-attempts')
+@click.option('--days', type=int, default=None, help='Archive attempts older than this many days.')
+def archive_attempts(days):
+    """Move old quiz attempts into the compressed archive table"""
+    archived = attempt_retention.archive(max_age_days=days)
+    click.echo(f'Archived {archived} quiz attempts.')
+
+@app.cli.command('rebuild-rollups')
+def rebuild_rollups():
+    """Recompute quiz stats from current and archived attempts"""
+    counted = attempt_retention.rebuild_rollups()
+    click.echo(f'Rebuilt quiz stats from {counted} attempts.')
+
 @app.errorhandler(404)
 def not_found(error):
     return render_template('index.html', error="Page not found"), 404
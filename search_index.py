@@ -0,0 +1,215 @@
+import logging
+import re
+
+from sqlalchemy import text
+from sqlalchemy.exc import OperationalError
+
+from app import db
+
+# Question rows use rowid = quiz_id * QUESTION_SLOTS + position, so all of a
+# quiz's questions can be replaced or removed with a rowid range scan
+QUESTION_SLOTS = 1000
+
+
+class SearchIndex:
+    """Full-text index over courses and generated questions using SQLite FTS5
+
+    content_fts holds one row per shared CourseContent (rowid = content id),
+    so identical uploads are indexed once. course_fts holds one row per course
+    (rowid = course id) with its title, plus the body of courses created
+    before content sharing. question_fts holds one row per question. Index
+    writes go through db.session so they commit or roll back together with
+    the change they mirror.
+    """
+
+    def __init__(self, snippet_tokens=12):
+        """
+        Initialize the SearchIndex
+
+        Args:
+            snippet_tokens (int): Approximate number of tokens per snippet
+        """
+        self.snippet_tokens = snippet_tokens
+        self.enabled = False
+
+    def ensure_schema(self):
+        """Create the FTS5 tables, filling them from existing data the first time"""
+        if db.engine.dialect.name != 'sqlite':
+            logging.info("Full-text search requires SQLite FTS5, search is disabled")
+            return
+
+        try:
+            with db.engine.begin() as connection:
+                existing = connection.execute(text(
+                    "SELECT count(*) FROM sqlite_master "
+                    "WHERE name IN ('content_fts', 'course_fts', 'question_fts')"
+                )).scalar()
+                connection.execute(text(
+                    "CREATE VIRTUAL TABLE IF NOT EXISTS content_fts "
+                    "USING fts5(content, tokenize='porter unicode61')"
+                ))
+                connection.execute(text(
+                    "CREATE VIRTUAL TABLE IF NOT EXISTS course_fts "
+                    "USING fts5(title, content, tokenize='porter unicode61')"
+                ))
+                connection.execute(text(
+                    "CREATE VIRTUAL TABLE IF NOT EXISTS question_fts "
+                    "USING fts5(question, explanation, quiz_id UNINDEXED, course_id UNINDEXED, "
+                    "position UNINDEXED, tokenize='porter unicode61')"
+                ))
+        except OperationalError as e:
+            logging.error(f"Could not create full-text search tables, search is disabled: {str(e)}")
+            return
+        self.enabled = True
+
+        if existing < 3:
+            self.rebuild()
+
+    def rebuild(self):
+        """Re-index every course and quiz"""
+        if not self.enabled:
+            return
+        from models import Course, Quiz
+
+        db.session.execute(text("DELETE FROM content_fts"))
+        db.session.execute(text("DELETE FROM course_fts"))
+        db.session.execute(text("DELETE FROM question_fts"))
+        for course in Course.query.yield_per(500):
+            self.index_course(course)
+        for quiz in Quiz.query.yield_per(500):
+            self.index_quiz(quiz)
+        db.session.commit()
+        logging.info("Search index rebuilt")
+
+    def index_course(self, course):
+        """Add or replace the index row for a course, indexing its shared content once"""
+        if not self.enabled:
+            return
+        db.session.execute(text("DELETE FROM course_fts WHERE rowid = :id"), {'id': course.id})
+        db.session.execute(
+            text("INSERT INTO course_fts (rowid, title, content) VALUES (:id, :title, :content)"),
+            {'id': course.id, 'title': course.title,
+             'content': course.legacy_content if course.content_id is None else ''}
+        )
+        if course.content_id is not None:
+            db.session.execute(text(
+                "INSERT INTO content_fts (rowid, content) SELECT :id, :content "
+                "WHERE NOT EXISTS (SELECT 1 FROM content_fts WHERE rowid = :id)"
+            ), {'id': course.content_id, 'content': course.content})
+
+    def index_quiz(self, quiz):
+        """Add or replace the index rows for a quiz's questions"""
+        if not self.enabled:
+            return
+        self._delete_quiz_rows(quiz.id)
+        rows = [
+            {
+                'rowid': quiz.id * QUESTION_SLOTS + position,
+                'question': question.get('question', ''),
+                'explanation': question.get('explanation', ''),
+                'quiz_id': quiz.id,
+                'course_id': quiz.course_id,
+                'position': position,
+            }
+            for position, question in enumerate(quiz.questions[:QUESTION_SLOTS])
+            if isinstance(question, dict)
+        ]
+        if rows:
+            db.session.execute(text(
+                "INSERT INTO question_fts (rowid, question, explanation, quiz_id, course_id, position) "
+                "VALUES (:rowid, :question, :explanation, :quiz_id, :course_id, :position)"
+            ), rows)
+
+    def remove_course(self, course_id, quiz_ids):
+        """Remove a course and its quizzes from the index"""
+        if not self.enabled:
+            return
+        db.session.execute(text("DELETE FROM course_fts WHERE rowid = :id"), {'id': course_id})
+        for quiz_id in quiz_ids:
+            self._delete_quiz_rows(quiz_id)
+
+    def remove_content(self, content_id):
+        """Remove shared content that no course uses any more"""
+        if not self.enabled:
+            return
+        db.session.execute(text("DELETE FROM content_fts WHERE rowid = :id"), {'id': content_id})
+
+    def search(self, query, kind='all', page=1, per_page=20):
+        """
+        Run a ranked full-text search
+
+        Args:
+            query (str): Free-text search terms
+            kind (str): 'courses', 'questions' or 'all'
+            page (int): 1-based page number
+            per_page (int): Results per page
+
+        Returns:
+            dict: Total hit count and one page of results per kind
+        """
+        match = self._match_expression(query)
+        results = {}
+        if not match:
+            return results
+
+        offset = (page - 1) * per_page
+        params = {'match': match, 'limit': per_page, 'offset': offset, 'tokens': self.snippet_tokens}
+
+        if kind in ('courses', 'all'):
+            total = db.session.execute(
+                text(f"SELECT count(DISTINCT course_id) FROM ({self._COURSE_HITS})"), params
+            ).scalar()
+            # MIN(rank) makes SQLite take snippet from the best-ranked hit
+            rows = db.session.execute(text(
+                "SELECT hits.course_id, course.title, hits.snippet, MIN(hits.rank) AS rank "
+                f"FROM ({self._COURSE_HITS}) AS hits JOIN course ON course.id = hits.course_id "
+                "GROUP BY hits.course_id ORDER BY rank LIMIT :limit OFFSET :offset"
+            ), params).mappings().all()
+            results['courses'] = {'total': total, 'results': [dict(row) for row in rows]}
+
+        if kind in ('questions', 'all'):
+            total = db.session.execute(
+                text("SELECT count(*) FROM question_fts WHERE question_fts MATCH :match"), params
+            ).scalar()
+            rows = db.session.execute(text(
+                "SELECT quiz_id, course_id, position, question, "
+                "snippet(question_fts, -1, '<mark>', '</mark>', '...', :tokens) AS snippet, "
+                "bm25(question_fts, 5.0, 1.0) AS rank "
+                "FROM question_fts WHERE question_fts MATCH :match "
+                "ORDER BY rank LIMIT :limit OFFSET :offset"
+            ), params).mappings().all()
+            results['questions'] = {'total': total, 'results': [dict(row) for row in rows]}
+
+        return results
+
+    # Courses matching by title or legacy body, plus every course sharing
+    # matching content
+    _COURSE_HITS = (
+        "SELECT rowid AS course_id, "
+        "snippet(course_fts, -1, '<mark>', '</mark>', '...', :tokens) AS snippet, "
+        "bm25(course_fts, 10.0, 1.0) AS rank "
+        "FROM course_fts WHERE course_fts MATCH :match "
+        "UNION ALL "
+        "SELECT course.id AS course_id, content_hits.snippet, content_hits.rank "
+        "FROM (SELECT rowid AS content_id, "
+        "snippet(content_fts, 0, '<mark>', '</mark>', '...', :tokens) AS snippet, "
+        "bm25(content_fts) AS rank "
+        "FROM content_fts WHERE content_fts MATCH :match) AS content_hits "
+        "JOIN course ON course.content_id = content_hits.content_id"
+    )
+
+    def _delete_quiz_rows(self, quiz_id):
+        """Delete a quiz's question rows by rowid range"""
+        db.session.execute(
+            text("DELETE FROM question_fts WHERE rowid >= :low AND rowid < :high"),
+            {'low': quiz_id * QUESTION_SLOTS, 'high': (quiz_id + 1) * QUESTION_SLOTS}
+        )
+
+    def _match_expression(self, query):
+        """Turn free text into an FTS5 query: all terms required, last one as a prefix"""
+        terms = re.findall(r'\w+', query or '')[:16]
+        if not terms:
+            return ''
+        quoted = [f'"{term}"' for term in terms]
+        quoted[-1] += '*'
+        return ' '.join(quoted)